@@ -1,4 +1,6 @@
 import os
+import sys
+import multiprocessing
 import h5py
 import numpy as np
 import scipy.io
@@ -8,6 +10,160 @@ import traceback
 import json
 from typing import Dict, Any, Optional, Tuple
 import hashlib
+import zipfile
+from collections import Counter
+from datetime import datetime, timezone
+from functools import lru_cache
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Кеш чанков HDF5 при загрузке: стандартного 1 МиБ меньше, чем чанк
+# типичного большого .mat, из-за чего чанки перечитываются заново
+H5_CHUNK_CACHE = {'rdcc_nbytes': 64 * 1024 * 1024, 'rdcc_nslots': 521, 'rdcc_w0': 0.75}
+
+# Типы, в которые scipy.io.loadmat переводит классы MATLAB (для отчета без загрузки данных)
+MAT_CLASS_DTYPES = {
+    'double': 'float64', 'single': 'float32',
+    'int8': 'int8', 'int16': 'int16', 'int32': 'int32', 'int64': 'int64',
+    'uint8': 'uint8', 'uint16': 'uint16', 'uint32': 'uint32', 'uint64': 'uint64',
+    'logical': 'uint8'
+}
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+# Размер блока при хешировании массива не в C-порядке
+HASH_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+@lru_cache(maxsize=4096)
+def _detect_mat_version_cached(file_path: str, mtime_ns: int, size: int) -> str:
+    """
+    Определяет версию .mat файла по заголовку, не загружая данные
+
+    mtime_ns и size входят в ключ кеша, чтобы измененный файл проверялся заново
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(520)
+    except OSError:
+        return 'unknown'
+
+    # v7.3 - это HDF5; MATLAB кладет сигнатуру после 512-байтного блока с текстом заголовка
+    if header[:8] == HDF5_SIGNATURE or header[512:520] == HDF5_SIGNATURE:
+        return 'v7.3'
+    if header.startswith(b'MATLAB 5.0 MAT-file'):
+        return 'v7.0_or_older'
+
+    # Заголовок не распознан (например, v4 без текстового заголовка) - спрашиваем
+    # scipy, который тоже читает только заголовок
+    try:
+        major, _ = scipy.io.matlab.matfile_version(file_path)
+    except (scipy.io.matlab.MatReadError, ValueError, OSError):
+        return 'unknown'
+    return 'v7.3' if major == 2 else 'v7.0_or_older'
+
+
+def _dumps_json(obj: Any, indent: bool = False) -> bytes:
+    """Сериализует отчет в UTF-8 JSON: через orjson, если установлен, иначе стандартным json"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=str, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def _save_npz(file_path: Path, arrays: Dict[str, np.ndarray]):
+    """
+    Пишет словарь массивов в .npz (как np.savez, без pickle)
+
+    np.savez(file_path, **arrays) не подходит: переменная MATLAB с именем 'file'
+    конфликтует с его первым аргументом
+    """
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for key, value in arrays.items():
+            with zf.open(key + '.npy', 'w', force_zip64=True) as member:
+                np.lib.format.write_array(member, value, allow_pickle=False)
+
+
+def _iter_mat_files(root):
+    """
+    Рекурсивно перечисляет .mat файлы (без учета регистра) через os.scandir
+
+    Как и os.walk, пропускает отсутствующие и нечитаемые директории
+    """
+    stack = [str(root)]
+    while stack:
+        directory = stack.pop()
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name[-4:].lower() == '.mat' and entry.is_file():
+                    yield entry.path
+
+
+def _new_hasher():
+    """Некриптографический хеш для проверки целостности: xxh3, если установлен xxhash, иначе md5"""
+    if xxhash is not None:
+        return xxhash.xxh3_64()
+    return hashlib.md5()
+
+
+if njit is not None:
+    # Без nnan/ninf: NaN в данных должен давать NaN в результате, как у np.max
+    @njit(parallel=True, cache=True, fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'})
+    def _max_relative_difference_kernel(a, b):
+        """Один векторизованный проход по плоским массивам: максимум и число NaN"""
+        m = 0.0
+        nans = 0
+        for i in prange(a.size):
+            r = abs(a[i] - b[i]) / (abs(a[i]) + 1e-10)
+            m = max(m, r)
+            if r != r:
+                nans += 1
+        return m, nans
+
+
+def _max_relative_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """max(|a - b| / (|a| + 1e-10)) через numexpr или numba, без промежуточных массивов"""
+    if numexpr is not None:
+        local_dict = {'a': a, 'b': b}
+        # Редукция max в numexpr пропускает NaN, поэтому NaN проверяем отдельно,
+        # чтобы результат совпадал с np.max. Отношение равно NaN, если в a или b
+        # есть NaN, а также при бесконечном a (inf / inf или NaN / inf)
+        if numexpr.evaluate('sum(where((a != a) | (b != b) | (abs(a) == inf), 1, 0))',
+                            local_dict={**local_dict, 'inf': np.inf}):
+            return float('nan')
+        return float(numexpr.evaluate('max(abs(a - b) / (abs(a) + 1e-10))', local_dict=local_dict))
+    if njit is not None:
+        max_rel_diff, nans = _max_relative_difference_kernel(a.ravel(), b.ravel())
+        return float('nan') if nans else float(max_rel_diff)
+    return float(np.max(np.abs(a - b) / (np.abs(a) + 1e-10)))
 
 
 class MatToNpyConverterDebug:
@@ -18,13 +174,24 @@ class MatToNpyConverterDebug:
 
     def compute_array_hash(self, array: np.ndarray) -> str:
         """Вычисляет хеш массива для проверки целостности"""
-        # Преобразуем в байты и вычисляем хеш
-        if array.dtype == np.float64 or array.dtype == np.float32:
-            # Для вещественных чисел используем округление для стабильности
-            array_rounded = np.round(array, decimals=6)
-            return hashlib.md5(array_rounded.tobytes()).hexdigest()[:8]
+        # Передаем буфер массива в хеш напрямую, без копии через tobytes().
+        # Вещественные числа не округляем: допуски сравнения проверяет
+        # compare_matrices, а хеш фиксирует точное содержимое
+        hasher = _new_hasher()
+        if array.dtype == object:
+            hasher.update(array.tobytes())
+        elif array.flags['C_CONTIGUOUS']:
+            # memoryview пустого массива нельзя привести к байтам - хешировать нечего
+            if array.size:
+                hasher.update(memoryview(array).cast('B'))
         else:
-            return hashlib.md5(array.tobytes()).hexdigest()[:8]
+            # Не C-порядок (например, транспонированный view после загрузки v7.3):
+            # хешируем логические байты в C-порядке по блокам строк, чтобы хеш
+            # зависел от содержимого, а не от раскладки, и не копировать весь массив
+            rows = max(1, HASH_BLOCK_BYTES // array[0].nbytes)
+            for i in range(0, len(array), rows):
+                hasher.update(memoryview(np.ascontiguousarray(array[i:i + rows])).cast('B'))
+        return hasher.hexdigest()[:8]
 
     def compare_matrices(self, mat_data: np.ndarray, npy_data: np.ndarray, filename: str) -> Dict[str, Any]:
         """Сравнивает два массива и выявляет различия"""
@@ -52,22 +219,23 @@ class MatToNpyConverterDebug:
         # 3. Если формы совпадают, проверяем значения
         if mat_data.shape == npy_data.shape:
             try:
+                if np.array_equal(mat_data, npy_data):
+                    # Совпадающие массивы (обычный случай) - погрешность не считаем
+                    comparison['values_equal'] = True
+                    if np.issubdtype(mat_data.dtype, np.floating):
+                        comparison['differences']['max_relative_difference'] = 0.0
                 # Используем относительную погрешность для float
-                if np.issubdtype(mat_data.dtype, np.floating):
-                    abs_diff = np.abs(mat_data - npy_data)
-                    rel_diff = abs_diff / (np.abs(mat_data) + 1e-10)
-                    max_rel_diff = np.max(rel_diff)
+                elif np.issubdtype(mat_data.dtype, np.floating):
+                    max_rel_diff = _max_relative_difference(mat_data, npy_data)
 
-                    comparison['differences']['max_relative_difference'] = float(max_rel_diff)
+                    comparison['differences']['max_relative_difference'] = max_rel_diff
                     comparison['values_equal'] = max_rel_diff < 1e-10
-                else:
-                    comparison['values_equal'] = np.array_equal(mat_data, npy_data)
 
             except Exception as e:
                 comparison['differences']['comparison_error'] = str(e)
 
         # 4. Проверяем, не является ли один массив транспонированным другого
-        if mat_data.ndim == 2 and npy_data.ndim == 2:
+        if not comparison['values_equal'] and mat_data.ndim == 2 and npy_data.ndim == 2:
             # Для 2D массивов проверяем транспонирование
             if mat_data.shape == npy_data.T.shape:
                 # Проверяем значения транспонированного
@@ -88,8 +256,8 @@ class MatToNpyConverterDebug:
 
         return comparison
 
-    def inspect_mat_file_deep(self, file_path: Path) -> Dict[str, Any]:
-        """Детальный анализ .mat файла"""
+    def inspect_mat_file_deep(self, file_path: Path, h5_file: Optional[h5py.File] = None) -> Dict[str, Any]:
+        """Детальный анализ .mat файла (h5_file - уже открытый v7.3 файл, если есть)"""
         info = {
             'file': str(file_path),
             'version': None,
@@ -99,11 +267,11 @@ class MatToNpyConverterDebug:
 
         try:
             # Определяем версию
-            version = self.detect_mat_version(file_path)
+            version = 'v7.3' if h5_file is not None else self.detect_mat_version(file_path)
             info['version'] = version
 
             if version == 'v7.3':
-                with h5py.File(file_path, 'r') as f:
+                with self._h5_context(file_path, h5_file) as f:
                     for key in f.keys():
                         var_info = {
                             'name': key,
@@ -139,28 +307,28 @@ class MatToNpyConverterDebug:
                             info['issues'].append(f"Variable '{key}' is a reference (may need special handling)")
 
             else:
-                # Старый формат
-                mat_data = scipy.io.loadmat(file_path)
-                for key in mat_data.keys():
-                    if not (key.startswith('__') and key.endswith('__')):
-                        var = mat_data[key]
-                        var_info = {
-                            'name': key,
-                            'type': type(var).__name__,
-                            'shape': var.shape if hasattr(var, 'shape') else None,
-                            'dtype': str(var.dtype) if hasattr(var, 'dtype') else None
-                        }
-                        info['variables'].append(var_info)
+                # Старый формат: whosmat читает только заголовки переменных, без данных
+                for key, shape, mat_class in scipy.io.whosmat(file_path):
+                    var_info = {
+                        'name': key,
+                        'type': 'ndarray',
+                        'shape': shape,
+                        'dtype': MAT_CLASS_DTYPES.get(mat_class, mat_class)
+                    }
+                    info['variables'].append(var_info)
 
         except Exception as e:
             info['issues'].append(f"Error inspecting file: {e}")
 
         return info
 
-    def load_mat_correctly(self, file_path: Path, variable_name: Optional[str] = None) -> Tuple[Any, Dict]:
+    def load_mat_correctly(self, file_path: Path, variable_name: Optional[str] = None,
+                           h5_file: Optional[h5py.File] = None) -> Tuple[Any, Dict]:
         """
         Загружает .mat файл с учетом всех особенностей MATLAB
 
+        h5_file - уже открытый v7.3 файл (см. open_mat_file), чтобы не открывать его повторно
+
         Возвращает:
         - данные
         - метаинформация о загрузке
@@ -173,14 +341,14 @@ class MatToNpyConverterDebug:
             'transpose_applied': False
         }
 
-        version = self.detect_mat_version(file_path)
+        version = 'v7.3' if h5_file is not None else self.detect_mat_version(file_path)
         meta['version'] = version
 
         if version == 'v7.3':
             # Загружаем через h5py
             data_dict = {}
 
-            with h5py.File(file_path, 'r') as f:
+            with self._h5_context(file_path, h5_file) as f:
                 for key in f.keys():
                     if isinstance(f[key], h5py.Dataset):
                         dataset = f[key]
@@ -199,20 +367,29 @@ class MatToNpyConverterDebug:
                                 else:
                                     data = raw_data
                                     meta['warnings'].append(f"Variable '{key}' is a reference to non-dataset")
-                            elif isinstance(raw_data, np.ndarray) and raw_data.dtype == np.object:
+                            elif isinstance(raw_data, np.ndarray) and raw_data.dtype == object:
                                 # Массив объектов
                                 try:
                                     # Пробуем разыменовать все элементы
-                                    dereferenced = []
-                                    for item in raw_data.flat:
-                                        if isinstance(item, h5py.Reference):
-                                            dereferenced.append(f[item][()])
-                                        else:
-                                            dereferenced.append(item)
-                                    data = np.array(dereferenced).reshape(raw_data.shape)
-                                except:
+                                    targets = [f[item] if isinstance(item, h5py.Reference) else item
+                                               for item in raw_data.flat]
+                                    layouts = {(t.shape, t.dtype) if isinstance(t, h5py.Dataset) else None
+                                               for t in targets}
+                                    if len(layouts) == 1 and None not in layouts and targets[0].ndim > 0:
+                                        # Все ссылки ведут на наборы одной формы и типа -
+                                        # читаем их прямо в общий предвыделенный массив
+                                        ref_shape, ref_dtype = layouts.pop()
+                                        out = np.empty((len(targets),) + ref_shape, dtype=ref_dtype)
+                                        for i, target in enumerate(targets):
+                                            target.read_direct(out[i])
+                                        data = out.reshape(raw_data.shape + ref_shape)
+                                    else:
+                                        dereferenced = [t[()] if isinstance(t, (h5py.Dataset, h5py.Group)) else t
+                                                        for t in targets]
+                                        data = np.array(dereferenced).reshape(raw_data.shape)
+                                except (KeyError, ValueError, TypeError, OSError) as e:
                                     data = raw_data
-                                    meta['warnings'].append(f"Could not dereference object array for '{key}'")
+                                    meta['warnings'].append(f"Could not dereference object array for '{key}': {e}")
                             else:
                                 data = raw_data
                         else:
@@ -227,7 +404,9 @@ class MatToNpyConverterDebug:
                                 'dtype': str(data.dtype)
                             })
 
-                            # Транспонируем (column-major → row-major)
+                            # Транспонируем (column-major → row-major).
+                            # data.T - это view без копирования; np.save запишет его
+                            # с fortran_order=True, и NumPy переставит оси при чтении
                             data = data.T
                             meta['transpose_applied'] = True
 
@@ -277,6 +456,49 @@ class MatToNpyConverterDebug:
 
         return data, meta
 
+    def stream_mat_to_npy(self, h5_file: h5py.File, npy_file_path: Path) -> Optional[Tuple[np.ndarray, Dict]]:
+        """
+        Записывает единственную числовую переменную v7.3 файла прямо в .npy
+
+        Заголовок .npy пишется с fortran_order=True, поэтому байты HDF5 (row-major
+        для исходной MATLAB формы) ложатся в файл как есть - транспонирование
+        выполняет NumPy при чтении.
+
+        Возвращает:
+        - memmap записанного массива (форма как после load_mat_correctly)
+        - метаинформация о загрузке
+        или None, если файл не подходит и нужно использовать load_mat_correctly
+        """
+        datasets = [key for key in h5_file.keys() if isinstance(h5_file[key], h5py.Dataset)]
+        if len(datasets) != 1:
+            return None
+
+        key = datasets[0]
+        dataset = h5_file[key]
+        if dataset.dtype.kind not in 'biuf' or dataset.ndim < 2 or dataset.size == 0:
+            return None
+
+        out = np.lib.format.open_memmap(npy_file_path, mode='w+', dtype=dataset.dtype,
+                                        shape=dataset.shape[::-1], fortran_order=True)
+        # out.T - C-contiguous view на данные файла в порядке HDF5
+        dataset.read_direct(out.T)
+        out.flush()
+
+        meta = {
+            'file': h5_file.filename,
+            'version': 'v7.3',
+            'loaded_variables': [{
+                'name': key,
+                'original_shape': dataset.shape,
+                'dtype': str(dataset.dtype)
+            }],
+            'warnings': [],
+            'transpose_applied': True,
+            'selected_variable': key,
+            'streamed': True
+        }
+        return out, meta
+
     def convert_and_verify(self, mat_file_path: Path, npy_file_path: Optional[Path] = None) -> Dict[str, Any]:
         """
         Конвертирует файл и сразу проверяет результат
@@ -293,14 +515,7 @@ class MatToNpyConverterDebug:
         }
 
         try:
-            # 1. Сначала анализируем исходный файл
-            file_info = self.inspect_mat_file_deep(mat_file_path)
-
-            # 2. Загружаем данные из .mat файла
-            mat_data, load_meta = self.load_mat_correctly(mat_file_path)
-            result['load_meta'] = load_meta
-
-            # 3. Создаем путь для выходного файла
+            # 1. Создаем путь для выходного файла
             if npy_file_path is None:
                 rel_path = mat_file_path.relative_to(self.input_root)
                 npy_file_path = self.output_root / rel_path.with_suffix('.npy')
@@ -308,45 +523,115 @@ class MatToNpyConverterDebug:
             npy_file_path.parent.mkdir(parents=True, exist_ok=True)
             result['output_file'] = str(npy_file_path)
 
-            # 4. Сохраняем в .npy
-            np.save(npy_file_path, mat_data, allow_pickle=True)
-
-            # 5. Загружаем обратно для проверки
-            npy_data = np.load(npy_file_path, allow_pickle=True)
+            # Открываем файл один раз для анализа и загрузки
+            version, h5_file = self.open_mat_file(mat_file_path)
+            try:
+                # 2. Сначала анализируем исходный файл
+                file_info = self.inspect_mat_file_deep(mat_file_path, h5_file)
 
-            # 6. Сравниваем данные
-            if isinstance(mat_data, np.ndarray) and isinstance(npy_data, np.ndarray):
-                comparison = self.compare_matrices(mat_data, npy_data, mat_file_path.name)
-                result['verification'] = comparison
+                # 3. Загружаем данные из .mat файла. Одиночный числовой массив v7.3
+                # пишем из HDF5 прямо в .npy, минуя промежуточный массив в памяти
+                streamed = None
+                if h5_file is not None:
+                    streamed = self.stream_mat_to_npy(h5_file, npy_file_path)
 
-                if not comparison['values_equal']:
-                    if comparison['transposed_equal']:
-                        result['warnings'].append("Arrays differ but one is transposed of the other")
-                    else:
-                        result['errors'].append("Arrays are different (not just transposed)")
+                if streamed is not None:
+                    mat_data, load_meta = streamed
                 else:
-                    result['success'] = True
+                    mat_data, load_meta = self.load_mat_correctly(mat_file_path, h5_file=h5_file)
+                result['load_meta'] = load_meta
+            finally:
+                if h5_file is not None:
+                    h5_file.close()
+
+            is_plain_array = isinstance(mat_data, np.ndarray) and mat_data.dtype != object
+            is_array_dict = isinstance(mat_data, dict) and all(
+                isinstance(v, np.ndarray) and v.dtype != object for v in mat_data.values())
+
+            # 4. Сохраняем в .npy (pickle нужен только для объектов и словарей).
+            # Словарь числовых массивов пишем в .npz - без pickle и с доступом к каждому массиву
+            if is_array_dict:
+                npy_file_path = npy_file_path.with_suffix('.npz')
+                result['output_file'] = str(npy_file_path)
+                _save_npz(npy_file_path, mat_data)
+            elif streamed is None:
+                np.save(npy_file_path, mat_data, allow_pickle=not is_plain_array)
+
+            if is_plain_array:
+                # 5. Числовой массив: .npy хранит байты без потерь, поэтому
+                # данные не перечитываем - через mmap сверяем только заголовок
+                # файла и фиксируем хеш исходных данных
+                npy_data = np.load(npy_file_path, mmap_mode='r', allow_pickle=False)
+                result['verification'] = {
+                    'filename': mat_file_path.name,
+                    'reloaded': False,
+                    'differences': {
+                        'shape': {'matlab': mat_data.shape, 'numpy': npy_data.shape},
+                        'dtype': {'matlab': str(mat_data.dtype), 'numpy': str(npy_data.dtype)}
+                    }
+                }
+                # После потоковой записи mat_data - это memmap выходного файла:
+                # хеш пришлось бы считать, перечитав весь .npy, поэтому его не считаем
+                if streamed is None:
+                    result['verification']['hash'] = self.compute_array_hash(mat_data)
 
-            elif isinstance(mat_data, dict) and isinstance(npy_data, dict):
-                # Для словарей проверяем ключи
+                if npy_data.shape == mat_data.shape and npy_data.dtype == mat_data.dtype:
+                    result['success'] = True
+                else:
+                    result['errors'].append("Saved .npy header does not match the source array")
+                del npy_data
+            elif is_array_dict:
+                # 5. Для архива проверяем состав: массивы читаются из .npz лениво
                 mat_keys = set(mat_data.keys())
-                npy_keys = set(npy_data.keys())
+                with np.load(npy_file_path, allow_pickle=False) as archive:
+                    npz_keys = set(archive.files)
 
-                if mat_keys == npy_keys:
+                if mat_keys == npz_keys:
                     result['success'] = True
                     result['verification'] = {
-                        'type': 'dict',
+                        'type': 'npz',
                         'keys_match': True,
                         'keys': list(mat_keys)
                     }
                 else:
-                    result['errors'].append(f"Dictionary keys differ: {mat_keys - npy_keys} vs {npy_keys - mat_keys}")
+                    result['errors'].append(f"Archive keys differ: {mat_keys - npz_keys} vs {npz_keys - mat_keys}")
             else:
-                # Простая проверка типов
-                if type(mat_data) == type(npy_data):
-                    result['success'] = True
+                # 5. Загружаем обратно для проверки
+                npy_data = np.load(npy_file_path, allow_pickle=True)
+
+                # 6. Сравниваем данные
+                if isinstance(mat_data, np.ndarray) and isinstance(npy_data, np.ndarray):
+                    comparison = self.compare_matrices(mat_data, npy_data, mat_file_path.name)
+                    result['verification'] = comparison
+
+                    if not comparison['values_equal']:
+                        if comparison['transposed_equal']:
+                            result['warnings'].append("Arrays differ but one is transposed of the other")
+                        else:
+                            result['errors'].append("Arrays are different (not just transposed)")
+                    else:
+                        result['success'] = True
+
+                elif isinstance(mat_data, dict) and isinstance(npy_data, dict):
+                    # Для словарей проверяем ключи
+                    mat_keys = set(mat_data.keys())
+                    npy_keys = set(npy_data.keys())
+
+                    if mat_keys == npy_keys:
+                        result['success'] = True
+                        result['verification'] = {
+                            'type': 'dict',
+                            'keys_match': True,
+                            'keys': list(mat_keys)
+                        }
+                    else:
+                        result['errors'].append(f"Dictionary keys differ: {mat_keys - npy_keys} vs {npy_keys - mat_keys}")
                 else:
-                    result['errors'].append(f"Types differ: {type(mat_data)} vs {type(npy_data)}")
+                    # Простая проверка типов
+                    if type(mat_data) == type(npy_data):
+                        result['success'] = True
+                    else:
+                        result['errors'].append(f"Types differ: {type(mat_data)} vs {type(npy_data)}")
 
         except Exception as e:
             result['errors'].append(str(e))
@@ -354,17 +639,32 @@ class MatToNpyConverterDebug:
 
         return result
 
+    def open_mat_file(self, file_path: Path) -> Tuple[str, Optional[h5py.File]]:
+        """
+        Определяет версию .mat файла и для v7.3 сразу открывает его
+
+        Возвращает:
+        - версию
+        - открытый h5py.File (закрывает вызывающий) или None для старого формата
+        """
+        version = self.detect_mat_version(file_path)
+        if version == 'v7.3':
+            return version, h5py.File(file_path, 'r', **H5_CHUNK_CACHE)
+        return version, None
+
+    def _h5_context(self, file_path: Path, h5_file: Optional[h5py.File]):
+        """Контекст для чтения v7.3: переданный файл не закрываем, иначе открываем сами"""
+        if h5_file is not None:
+            return nullcontext(h5_file)
+        return h5py.File(file_path, 'r', **H5_CHUNK_CACHE)
+
     def detect_mat_version(self, file_path: Path) -> str:
-        """Определяет версию .mat файла"""
+        """Определяет версию .mat файла (результат кешируется, пока файл не изменился)"""
         try:
-            with h5py.File(file_path, 'r') as f:
-                return 'v7.3'
-        except (OSError, IOError):
-            try:
-                scipy.io.loadmat(file_path, mat_dtype=True)
-                return 'v7.0_or_older'
-            except:
-                return 'unknown'
+            stat = os.stat(file_path)
+        except OSError:
+            return 'unknown'
+        return _detect_mat_version_cached(str(file_path), stat.st_mtime_ns, stat.st_size)
 
     def batch_convert_with_verification(self) -> Dict[str, Any]:
         """
@@ -373,11 +673,7 @@ class MatToNpyConverterDebug:
         print(f"🔍 Начинаем конвертацию с проверкой целостности данных...")
 
         # Находим все файлы
-        mat_files = []
-        for root, dirs, files in os.walk(self.input_root):
-            for file in files:
-                if file.lower().endswith('.mat'):
-                    mat_files.append(Path(root) / file)
+        mat_files = [Path(p) for p in _iter_mat_files(self.input_root)]
 
         if not mat_files:
             print("⚠️  Файлы .mat не найдены")
@@ -391,80 +687,89 @@ class MatToNpyConverterDebug:
             output_dir = self.output_root / rel_path.parent
             output_dir.mkdir(parents=True, exist_ok=True)
 
-        # Конвертируем и проверяем
-        results = {}
-        issues_count = 0
-
-        for i, mat_file in enumerate(mat_files, 1):
-            print(f"\n[{i}/{len(mat_files)}] Анализируем: {mat_file.relative_to(self.input_root)}")
-
-            # Конвертируем с проверкой
-            result = self.convert_and_verify(mat_file)
-
-            # Сохраняем результат
-            results[str(mat_file)] = result
+        # Конвертируем и проверяем (файлы независимы - обрабатываем параллельно).
+        # Результаты сразу пишем построчно в .jsonl, в памяти держим только счетчики
+        stats = {
+            'total_files': 0,
+            'successful': 0,
+            'with_warnings': 0,
+            'with_errors': 0
+        }
+        issue_counts = Counter()
+        report_file = self.output_root / 'conversion_report.jsonl'
+
+        tasks = [(str(p), str(self.input_root), str(self.output_root)) for p in mat_files]
+
+        # На Linux используем fork: рабочие процессы наследуют уже импортированные
+        # h5py/scipy/numpy, а не импортируют их заново (на macOS/Windows - spawn)
+        mp_context = multiprocessing.get_context('fork' if sys.platform.startswith('linux') else 'spawn')
+
+        with open(report_file, 'wb') as report, \
+                ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=mp_context) as executor:
+            for i, (mat_file, result) in enumerate(executor.map(_convert_one, tasks, chunksize=4), 1):
+                mat_file = Path(mat_file)
+                print(f"\n[{i}/{len(mat_files)}] Обработан: {mat_file.relative_to(self.input_root)}")
+
+                # Сохраняем результат
+                report.write(_dumps_json(result) + b'\n')
+                stats['total_files'] += 1
+                stats['successful'] += bool(result['success'])
+                stats['with_warnings'] += bool(result.get('warnings'))
+                stats['with_errors'] += bool(result.get('errors'))
+                issue_counts.update(result.get('errors', []))
+
+                # Выводим краткий отчет
+                if result['success']:
+                    print(f"   ✅ Успешно")
+                    if 'verification' in result and 'differences' in result['verification']:
+                        shape_info = result['verification']['differences'].get('shape', {})
+                        if 'matlab' in shape_info and 'numpy' in shape_info:
+                            print(f"   📐 Форма: {shape_info['matlab']} → {shape_info['numpy']}")
+                else:
+                    print(f"   ⚠️  Проблемы:")
+                    for error in result.get('errors', []):
+                        print(f"      - {error}")
 
-            # Выводим краткий отчет
-            if result['success']:
-                print(f"   ✅ Успешно")
-                if 'verification' in result and 'differences' in result['verification']:
-                    shape_info = result['verification']['differences'].get('shape', {})
-                    if 'matlab' in shape_info and 'numpy' in shape_info:
-                        print(f"   📐 Форма: {shape_info['matlab']} → {shape_info['numpy']}")
-            else:
-                print(f"   ⚠️  Проблемы:")
-                for error in result.get('errors', []):
-                    print(f"      - {error}")
-                issues_count += 1
+                # Предупреждения
+                for warning in result.get('warnings', []):
+                    print(f"   ⚠️  {warning}")
 
-            # Предупреждения
-            for warning in result.get('warnings', []):
-                print(f"   ⚠️  {warning}")
+        stats['common_issues'] = dict(issue_counts.most_common(10))
 
-        # Сохраняем детальный отчет
-        self.save_detailed_report(results)
+        # Сохраняем итоговую сводку
+        summary_file = self.save_detailed_report(stats)
 
         print(f"\n{'=' * 60}")
         print(f"📊 ИТОГОВЫЙ ОТЧЕТ:")
-        print(f"   Всего файлов: {len(mat_files)}")
-        print(f"   Успешно: {len([r for r in results.values() if r['success']])}")
-        print(f"   С проблемами: {issues_count}")
-        print(f"   Детальный отчет сохранен в: {self.output_root / 'conversion_report.json'}")
+        print(f"   Всего файлов: {stats['total_files']}")
+        print(f"   Успешно: {stats['successful']}")
+        print(f"   С проблемами: {stats['total_files'] - stats['successful']}")
+        print(f"   Детальный отчет сохранен в: {report_file}")
+        print(f"   Сводка: {summary_file}")
 
-        return results
+        return stats
 
-    def save_detailed_report(self, results: Dict[str, Any]):
-        """Сохраняет детальный отчет о конвертации"""
-        report_file = self.output_root / 'conversion_report.json'
+    def save_detailed_report(self, stats: Dict[str, Any]) -> Path:
+        """Сохраняет сводку о конвертации (пофайловые результаты уже записаны в conversion_report.jsonl)"""
+        summary_file = self.output_root / 'conversion_report_summary.json'
 
-        # Собираем статистику
-        stats = {
-            'total_files': len(results),
-            'successful': sum(1 for r in results.values() if r['success']),
-            'with_warnings': sum(1 for r in results.values() if r.get('warnings')),
-            'with_errors': sum(1 for r in results.values() if r.get('errors')),
-            'file_types': {},
-            'common_issues': {}
+        full_report = {
+            'summary': stats,
+            'report_file': str(self.output_root / 'conversion_report.jsonl'),
+            'timestamp': datetime.now(timezone.utc).isoformat()
         }
 
-        # Анализируем проблемы
-        all_issues = []
-        for file_result in results.values():
-            all_issues.extend(file_result.get('errors', []))
+        with open(summary_file, 'wb') as f:
+            f.write(_dumps_json(full_report, indent=True))
 
-        from collections import Counter
-        issue_counts = Counter(all_issues)
-        stats['common_issues'] = dict(issue_counts.most_common(10))
+        return summary_file
 
-        # Сохраняем полный отчет
-        full_report = {
-            'summary': stats,
-            'conversion_details': results,
-            'timestamp': str(np.datetime64('now'))
-        }
 
-        with open(report_file, 'w', encoding='utf-8') as f:
-            json.dump(full_report, f, indent=2, ensure_ascii=False, default=str)
+def _convert_one(args: Tuple[str, str, str]) -> Tuple[str, Dict[str, Any]]:
+    """Конвертирует один файл в рабочем процессе пула"""
+    mat_file, input_root, output_root = args
+    converter = MatToNpyConverterDebug(input_root, output_root)
+    return mat_file, converter.convert_and_verify(Path(mat_file))
 
 
 def test_single_file():
@@ -550,4 +855,4 @@ if __name__ == "__main__":
             print(f"Файл {test_file} не найден. Создайте тестовый файл или укажите путь через --test-file")
     else:
         converter = MatToNpyConverterDebug(args.input, args.output)
-        results = converter.batch_convert_with_verification()
+        summary = converter.batch_convert_with_verification()
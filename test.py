@@ -1,217 +1,368 @@
+import gc
+import heapq
+import io
+import pickle
+import re
+import sys
+import warnings
+import zipfile
 import torch
-from collections import OrderedDict
+from collections import defaultdict
+
+try:
+    from safetensors import safe_open
+except ImportError:
+    safe_open = None
+
+FIRST_CONV_KEYS = ('patch_embed.proj.weight', 'patch_embed.weight')
+LEVELS = ('encoder_level1', 'encoder_level2', 'encoder_level3')
+# Номер блока сразу после номера уровня: encoder_level1.0.norm1.weight -> '0'
+LEVEL_BLOCK_RE = re.compile(r'\.(\d+)\.')
+# Номер latent блока: 3.norm1.weight -> '3'
+LATENT_RE = re.compile(r'^(\d+)\.')
+# Номер блока декодера/refinement: refinement.2.norm1.weight -> '2'
+DECODER_RE = re.compile(r'ent\.(\d+)\.')
+# Группа ключа для отладочного вывода. Условия проверяются по порядку (первое
+# совпавшее побеждает), поэтому каждое - lookahead от начала строки, а имя
+# группы берется из m.lastgroup; ключ без совпадений попадает в 'other'
+GROUP_RE = re.compile(
+    r'(?=.*(?:mbed|proj))(?P<patch_embed>)'
+    r'|(?=.*_level1)(?P<encoder_level1>)'
+    r'|(?=.*_level2)(?P<encoder_level2>)'
+    r'|(?=.*_level3)(?P<encoder_level3>)'
+    r'|(?=\d\.)(?P<latent>)'
+    r'|(?=.*ent\.)(?P<decoder>)'
+    r'|(?=.*\.body\.0\.weight)(?P<downsample>)'
+    r'|(?=.*ody\.0\.weight)(?P<upsample>)'
+    r'|(?=(?:nv\.)?weight\Z)(?P<output>)'
+)
+# Порядок вывода групп
+GROUP_NAMES = ('patch_embed', 'encoder_level1', 'encoder_level2', 'encoder_level3', 'latent',
+               'decoder', 'downsample', 'upsample', 'output', 'other')
+
+
+class ShapeOnlyTensor:
+    """Заглушка тензора: только форма и тип, без данных"""
+
+    def __init__(self, size, dtype=None):
+        self.shape = torch.Size(size)
+        self.dtype = dtype
+
+    def dim(self):
+        return len(self.shape)
+
+
+def _rebuild_shape_only(storage, storage_offset, size, stride, *args, **kwargs):
+    # Замена torch._utils._rebuild_tensor_v2: storage - это dtype из persistent_load
+    return ShapeOnlyTensor(size, storage)
+
+
+def _rebuild_parameter_shape_only(data, requires_grad, backward_hooks, *args, **kwargs):
+    return data
+
+
+def _rebuild_from_type_shape_only(func, new_type, args, state):
+    # Подклассы тензоров: тип и состояние для анализа форм не нужны
+    return func(*args)
+
+
+class ShapeOnlyUnpickler(pickle.Unpickler):
+    """
+    Читает data.pkl из zip-чекпоинта PyTorch, не трогая storage_data/*
+
+    Вместо storage возвращается его dtype, вместо тензора - ShapeOnlyTensor.
+    Как и torch.load(weights_only=True), разрешает только глобалы state_dict
+    """
+
+    def find_class(self, module, name):
+        if module == 'torch._utils' and name == '_rebuild_tensor_v2':
+            return _rebuild_shape_only
+        if module == 'torch._utils' and name in ('_rebuild_parameter', '_rebuild_parameter_with_state'):
+            return _rebuild_parameter_shape_only
+        if module == 'torch._tensor' and name == '_rebuild_from_type_v2':
+            return _rebuild_from_type_shape_only
+        if (module, name) == ('collections', 'OrderedDict') or (
+                module == 'torch' and (name.endswith('Storage') or name in ('Size', 'device')
+                                       or isinstance(getattr(torch, name, None), torch.dtype))):
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Недопустимый глобал в чекпоинте: {module}.{name}")
+
+    def persistent_load(self, pid):
+        # pid = ('storage', storage_type, key, location, numel). Тип storage - это
+        # устаревший класс вроде torch.FloatStorage: обращение к его dtype выдает
+        # предупреждение о TypedStorage, которого torch.load не показывает
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='TypedStorage is deprecated', category=UserWarning)
+            return getattr(pid[1], 'dtype', None)
+
+
+def load_shapes_only(checkpoint_path):
+    """Загружает структуру чекпоинта с ShapeOnlyTensor вместо тензоров (читается только data.pkl)"""
+    with zipfile.ZipFile(checkpoint_path) as zf:
+        pkl_names = [n for n in zf.namelist() if n == 'data.pkl' or n.endswith('/data.pkl')]
+        if not pkl_names:
+            raise zipfile.BadZipFile(f"{checkpoint_path}: data.pkl not found")
+        with zf.open(pkl_names[0]) as f:
+            return ShapeOnlyUnpickler(f).load()
+
+
+def iter_shapes(checkpoint_path):
+    """
+    Лениво перечисляет параметры чекпоинта: (ключ, форма, dtype)
+
+    Для не-тензоров вместо формы отдается None, а вместо dtype - тип значения
+    """
+    if str(checkpoint_path).endswith('.safetensors'):
+        if safe_open is None:
+            raise ImportError("Для .safetensors требуется пакет safetensors")
+        with safe_open(checkpoint_path, framework='pt') as f:
+            for k in f.keys():
+                t = f.get_slice(k)
+                yield k, torch.Size(t.get_shape()), t.get_dtype()
+        return
+
+    # Нужны только формы тензоров, поэтому из zip-архива читаем один data.pkl.
+    # Старый (не zip) формат так не прочитать - грузим его целиком; torch до 1.13
+    # не знает weights_only, тогда грузим как раньше
+    try:
+        checkpoint = load_shapes_only(checkpoint_path)
+    except zipfile.BadZipFile:
+        try:
+            checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=True)
+        except TypeError:
+            checkpoint = torch.load(checkpoint_path, map_location='cpu')
+
+    # Остальное содержимое чекпоинта (например, состояние оптимизатора) не держим
+    state_dict = checkpoint['model_state']
+    del checkpoint
+
+    for k, v in state_dict.items():
+        if hasattr(v, 'shape'):
+            yield k, v.shape, v.dtype
+        else:
+            yield k, None, type(v)
 
 
-def analyze_checkpoint(checkpoint_path):
-    print(f"Анализ файла: {checkpoint_path}")
+def analyze_checkpoint(checkpoint_path, verbose=False):
+    """Выводит параметры архитектуры из чекпоинта и возвращает конфигурацию Restormer
 
-    # Загружаем checkpoint
-    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    Без verbose печатаются только разделы 1-3, а данные для разделов 4-8
+    (resample слои, heads, выходной слой, конфигурация, группы ключей) не собираются
+    """
+    # Отчет копим в буфере и выводим одной записью в конце
+    buf = io.StringIO()
 
-    # Извлекаем state_dict
-    state_dict = checkpoint['model_state']
-    print(f"Найден state_dict с {len(state_dict)} параметрами")
+    def out(*args, **kwargs):
+        print(*args, **kwargs, file=buf)
 
-    print("\n=== ОСНОВНОЙ АНАЛИЗ АРХИТЕКТУРЫ ===")
+    try:
+        return _analyze_checkpoint(checkpoint_path, verbose, buf, out)
+    finally:
+        sys.stdout.write(buf.getvalue())
 
-    # 1. Выводим ключевые параметры
-    print("1. Ключевые параметры модели:")
 
-    # Ищем все уникальные префиксы
+def _analyze_checkpoint(checkpoint_path, verbose, buf, out):
+    out(f"Анализ файла: {checkpoint_path}")
+
+    # Один проход по потоку параметров собирает данные для всех разделов отчета
+    meta = {}
     prefixes = set()
-    for k in state_dict.keys():
+    shapes = {}
+    first_conv_key = None
+    first_conv_shape = None
+    level_dims = {}
+    level_blocks = defaultdict(int)
+    resample_lines = []
+    temperature_lines = []
+    out_channels = None
+    out_shape = None
+    groups = defaultdict(list)
+
+    for k, shape, dtype in iter_shapes(checkpoint_path):
+        ndim = len(shape) if shape is not None else None
+        meta[k] = (shape, ndim, dtype)
+        # Дешевая проверка первого символа отсекает latent-ветки для большинства ключей
+        first_is_digit = k[:1].isdigit()
+        if verbose:
+            shapes[k] = tuple(shape) if shape is not None else dtype
+
+        # Уникальные префиксы
         if '.' in k:
-            prefix = k.split('.')[0]
-            prefixes.add(prefix)
+            prefixes.add(k.split('.')[0])
 
-    print("Уникальные префиксы:", sorted(prefixes))
+        # Первый сверточный слой
+        if first_conv_key is None and ('proj.weight' in k or ('conv' in k and 'weight' in k and ndim == 4)):
+            first_conv_key, first_conv_shape = k, shape
 
-    # 2. Определяем входные параметры
-    print("\n2. Входные параметры:")
+        # Ищем normalization слои для определения размерности
+        if 'norm' in k and 'weight' in k and ndim == 1:
+            level = None
+            block_match = None
+
+            # Уровень энкодера - одна цифра сразу после '_level'
+            idx = k.find('_level')
+            if idx >= 0 and idx + 6 < len(k) and k[idx + 6] in '123':
+                level = LEVELS[int(k[idx + 6]) - 1]
+                level_block_match = LEVEL_BLOCK_RE.match(k, idx + 7)
+                block_match = level_block_match.group(1) if level_block_match else None
+            elif '.norm' in k:
+                latent_match = LATENT_RE.match(k) if first_is_digit else None
+                if latent_match:  # latent блоки (0., 1., 2., 3.)
+                    level = 'latent'
+                    block_match = latent_match.group(1)
+                elif 'ent.' in k:  # decoder блоки
+                    level = 'decoder_level3'
+                    decoder_match = DECODER_RE.search(k)
+                    block_match = decoder_match.group(1) if decoder_match else None
+
+            if level is not None:
+                level_dims[level] = shape[0]
+                # Определяем номер блока
+                if block_match is not None:
+                    block_num = int(block_match)
+                    if block_num + 1 > level_blocks[level]:
+                        level_blocks[level] = block_num + 1
+
+        # Выходной слой (последний conv слой)
+        if k == 'weight' and out_channels is None and ndim == 4:
+            out_shape = shape
+            out_channels = shape[0]
+
+        # Остальное нужно только для подробного отчета
+        if not verbose:
+            continue
+
+        # Downsample/Upsample слои
+        if ndim == 4:  # Conv слои
+            if '.body.0.weight' in k:
+                resample_lines.append(f"  Downsample: {k} -> {shape}")
+            elif 'ody.0.weight' in k:
+                resample_lines.append(f"  Upsample: {k} -> {shape}")
+            elif 'chan_level' in k:
+                resample_lines.append(f"  Channel reduction: {k} -> {shape}")
 
-    # Ищем первый сверточный слой
-    first_conv_key = None
-    for k in state_dict.keys():
-        if 'proj.weight' in k or ('conv' in k and 'weight' in k and state_dict[k].dim() == 4):
-            first_conv_key = k
+        # Heads из temperature
+        if 'temperature' in k:
+            temperature_lines.append(f"  {k}: shape {tuple(shape)} -> {shape[0]} heads")
+
+        # Группы ключей
+        group_match = GROUP_RE.match(k)
+        groups[group_match.lastgroup if group_match else 'other'].append(k)
+
+    # Поток исчерпан - загруженный state_dict больше не нужен
+    gc.collect()
+
+    # Первый слой Restormer известен по имени - берем его напрямую,
+    # а найденный при проходе ключ остается запасным вариантом
+    for candidate in FIRST_CONV_KEYS:
+        candidate_meta = meta.get(candidate)
+        if candidate_meta is not None and candidate_meta[1] == 4:
+            first_conv_key, first_conv_shape = candidate, candidate_meta[0]
             break
 
+    out(f"Найден state_dict с {len(meta)} параметрами")
+
+    out("\n=== ОСНОВНОЙ АНАЛИЗ АРХИТЕКТУРЫ ===")
+
+    # 1. Выводим ключевые параметры
+    out("1. Ключевые параметры модели:")
+    out("Уникальные префиксы:", sorted(prefixes))
+
+    # 2. Определяем входные параметры
+    out("\n2. Входные параметры:")
+
     if first_conv_key:
-        shape = state_dict[first_conv_key].shape
-        print(f"  Первый слой ({first_conv_key}): {shape}")
-        print(f"  → Входные каналы (inp_channels) = {shape[1]}")
-        print(f"  → Начальная размерность (dim) = {shape[0]}")
+        shape = first_conv_shape
+        out(f"  Первый слой ({first_conv_key}): {shape}")
+        out(f"  → Входные каналы (inp_channels) = {shape[1]}")
+        out(f"  → Начальная размерность (dim) = {shape[0]}")
         inp_channels = shape[1]
         initial_dim = shape[0]
     else:
-        print("  Не найден первый сверточный слой")
+        out("  Не найден первый сверточный слой")
         inp_channels = None
         initial_dim = None
 
     # 3. Анализируем архитектуру по уровням
-    print("\n3. Размерность каналов по уровням:")
-
-    # Собираем информацию по уровням
-    level_dims = {}
-    level_blocks = {}
-
-    for k, v in state_dict.items():
-        # Ищем normalization слои для определения размерности
-        if 'norm' in k and 'weight' in k and v.dim() == 1:
-            # Определяем уровень
-            if '_level1' in k:
-                level = 'encoder_level1'
-                level_dims[level] = v.shape[0]
-                # Определяем номер блока
-                parts = k.split('_level1.')[1].split('.')
-                if parts[0].isdigit():
-                    block_num = int(parts[0])
-                    level_blocks[level] = max(level_blocks.get(level, 0), block_num + 1)
-
-            elif '_level2' in k:
-                level = 'encoder_level2'
-                level_dims[level] = v.shape[0]
-                parts = k.split('_level2.')[1].split('.')
-                if parts[0].isdigit():
-                    block_num = int(parts[0])
-                    level_blocks[level] = max(level_blocks.get(level, 0), block_num + 1)
-
-            elif '_level3' in k:
-                level = 'encoder_level3'
-                level_dims[level] = v.shape[0]
-                parts = k.split('_level3.')[1].split('.')
-                if parts[0].isdigit():
-                    block_num = int(parts[0])
-                    level_blocks[level] = max(level_blocks.get(level, 0), block_num + 1)
-
-            elif k[0].isdigit() and '.norm' in k:  # latent блоки (0., 1., 2., 3.)
-                level = 'latent'
-                level_dims[level] = v.shape[0]
-                block_num = int(k[0])
-                level_blocks[level] = max(level_blocks.get(level, 0), block_num + 1)
-
-            elif 'ent.' in k and '.norm' in k:  # decoder блоки
-                level = 'decoder_level3'
-                level_dims[level] = v.shape[0]
-                parts = k.split('ent.')[1].split('.')
-                if parts[0].isdigit():
-                    block_num = int(parts[0])
-                    level_blocks[level] = max(level_blocks.get(level, 0), block_num + 1)
+    out("\n3. Размерность каналов по уровням:")
 
     # Выводим информацию об уровнях
     level_order = ['encoder_level1', 'encoder_level2', 'encoder_level3', 'latent', 'decoder_level3']
     for level in level_order:
         if level in level_dims:
             blocks = level_blocks.get(level, '?')
-            print(f"  {level:20} : {level_dims[level]:4} channels, {blocks} blocks")
+            out(f"  {level:20} : {level_dims[level]:4} channels, {blocks} blocks")
+
+    config = _infer_restormer_config(inp_channels, initial_dim, out_channels, level_dims, level_blocks)
+    if not verbose:
+        return config
 
     # 4. Определяем downsample/upsample
-    print("\n4. Downsample/Upsample слои:")
-    for k, v in state_dict.items():
-        if v.dim() == 4:  # Conv слои
-            if '.body.0.weight' in k:
-                print(f"  Downsample: {k} -> {v.shape}")
-            elif 'ody.0.weight' in k:
-                print(f"  Upsample: {k} -> {v.shape}")
-            elif 'chan_level' in k:
-                print(f"  Channel reduction: {k} -> {v.shape}")
+    out("\n4. Downsample/Upsample слои:")
+    for line in resample_lines:
+        out(line)
 
     # 5. Heads из temperature
-    print("\n5. Attention heads:")
-    for k, v in state_dict.items():
-        if 'temperature' in k:
-            print(f"  {k}: shape {tuple(v.shape)} -> {v.shape[0]} heads")
+    out("\n5. Attention heads:")
+    for line in temperature_lines:
+        out(line)
 
     # 6. Выходной слой
-    print("\n6. Выходной слой:")
-    for k, v in state_dict.items():
-        if k == 'weight' and v.dim() == 4:  # Последний conv слой
-            print(f"  output layer: {k} -> {v.shape}")
-            print(f"  → Выходные каналы (out_channels) = {v.shape[0]}")
-            out_channels = v.shape[0]
-            break
+    out("\n6. Выходной слой:")
+    if out_channels is not None:
+        out(f"  output layer: weight -> {out_shape}")
+        out(f"  → Выходные каналы (out_channels) = {out_channels}")
 
     # 7. Предполагаемая конфигурация
-    print("\n=== ПРЕДПОЛАГАЕМАЯ КОНФИГУРАЦИЯ МОДЕЛИ ===")
+    out("\n=== ПРЕДПОЛАГАЕМАЯ КОНФИГУРАЦИЯ МОДЕЛИ ===")
+
+    if config is not None:
+        args = ',\n'.join(f"    {name}={value!r}" for name, value in config.items())
+        out(f"\nmodel = restormer_arch.Restormer(\n{args}\n)\n")
+
+    # 8. Для отладки: выводим все ключи сгруппированные
+    out("\n=== ВСЕ КЛЮЧИ ПО ГРУППАМ ===")
+
+    lines = []
+    for group_name in GROUP_NAMES:
+        keys = groups.get(group_name, [])
+        if keys:
+            lines.append(f"\n{group_name.upper()} ({len(keys)} параметров):")
+            lines.extend(f"  {k} -> {shapes[k]}" for k in heapq.nsmallest(5, keys))  # первые 5
+            if len(keys) > 5:
+                lines.append(f"  ... и еще {len(keys) - 5} параметров")
+    if lines:
+        buf.write('\n'.join(lines) + '\n')
+
+    return config
+
 
-    if initial_dim and 'encoder_level1' in level_dims:
+def _infer_restormer_config(inp_channels, initial_dim, out_channels, level_dims, level_blocks):
+    """Собирает аргументы Restormer(...) из найденных размерностей; None, если данных мало"""
+    if not (initial_dim and 'encoder_level1' in level_dims):
+        return None
+
+    return {
+        'inp_channels': inp_channels,
+        'out_channels': out_channels if out_channels is not None else 3,
+        'dim': initial_dim,
         # Определяем num_blocks
-        num_blocks = [
+        'num_blocks': [
             level_blocks.get('encoder_level1', 2),
             level_blocks.get('encoder_level2', 3),
             level_blocks.get('encoder_level3', 3),
             level_blocks.get('latent', 4)
-        ]
-
+        ],
+        'num_refinement_blocks': level_blocks.get('decoder_level3', 4),
         # Определяем heads (по умолчанию)
-        heads = [1, 2, 4, 8]
-
-        config = f"""
-model = restormer_arch.Restormer(
-    inp_channels={inp_channels},
-    out_channels={out_channels if 'out_channels' in locals() else 3},
-    dim={initial_dim},
-    num_blocks={num_blocks},
-    num_refinement_blocks={level_blocks.get('decoder_level3', 4)},
-    heads={heads},
-    ffn_expansion_factor=2.66,
-    bias=False,
-    LayerNorm_type='WithBias',
-    dual_pixel_task={inp_channels == 6 if inp_channels else False}
-)
-"""
-        print(config)
-
-    # 8. Для отладки: выводим все ключи сгруппированные
-    print("\n=== ВСЕ КЛЮЧИ ПО ГРУППАМ ===")
-
-    groups = {
-        'patch_embed': [],
-        'encoder_level1': [],
-        'encoder_level2': [],
-        'encoder_level3': [],
-        'latent': [],
-        'decoder': [],
-        'downsample': [],
-        'upsample': [],
-        'output': [],
-        'other': []
+        'heads': [1, 2, 4, 8],
+        'ffn_expansion_factor': 2.66,
+        'bias': False,
+        'LayerNorm_type': 'WithBias',
+        'dual_pixel_task': inp_channels == 6 if inp_channels else False
     }
 
-    for k in state_dict.keys():
-        if 'mbed' in k or 'proj' in k:
-            groups['patch_embed'].append(k)
-        elif '_level1' in k:
-            groups['encoder_level1'].append(k)
-        elif '_level2' in k:
-            groups['encoder_level2'].append(k)
-        elif '_level3' in k:
-            groups['encoder_level3'].append(k)
-        elif k[0].isdigit() and k[1] == '.':
-            groups['latent'].append(k)
-        elif 'ent.' in k:
-            groups['decoder'].append(k)
-        elif '.body.0.weight' in k:
-            groups['downsample'].append(k)
-        elif 'ody.0.weight' in k:
-            groups['upsample'].append(k)
-        elif k in ['weight', 'nv.weight']:
-            groups['output'].append(k)
-        else:
-            groups['other'].append(k)
-
-    for group_name, keys in groups.items():
-        if keys:
-            print(f"\n{group_name.upper()} ({len(keys)} параметров):")
-            for k in sorted(keys)[:5]:  # первые 5
-                if k in state_dict:
-                    shape = tuple(state_dict[k].shape) if hasattr(state_dict[k], 'shape') else type(state_dict[k])
-                    print(f"  {k} -> {shape}")
-            if len(keys) > 5:
-                print(f"  ... и еще {len(keys) - 5} параметров")
-
-    return state_dict
-
 
 # Запускаем анализ
-state_dict = analyze_checkpoint("/home/linkoln-xd/python_projects/DocRes-master/checkpoints/experiment_name/33000.pkl")
\ No newline at end of file
+config = analyze_checkpoint("/home/linkoln-xd/python_projects/DocRes-master/checkpoints/experiment_name/33000.pkl",
+                            verbose=True)
\ No newline at end of file
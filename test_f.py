@@ -1,74 +1,131 @@
+import io
+import sys
 import numpy as np
 import h5py
 import scipy.io
 from pathlib import Path
 
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+# Коды H5D_layout_t (h5py.h5d.COMPACT/CONTIGUOUS/CHUNKED/VIRTUAL)
+H5_LAYOUTS = {0: 'compact', 1: 'contiguous', 2: 'chunked', 3: 'virtual'}
 
-def debug_transposition_issue(mat_file_path):
-    """Анализирует и демонстрирует проблему транспонирования"""
 
+def _is_hdf5(mat_file_path):
+    """Проверяет сигнатуру HDF5 (v7.3); MATLAB пишет ее после 512-байтного заголовка"""
+    with open(mat_file_path, 'rb') as f:
+        header = f.read(520)
+    return header[:8] == HDF5_SIGNATURE or header[512:520] == HDF5_SIGNATURE
+
+
+def _memory_order(array):
+    """Порядок хранения 2D массива по strides: подряд идут элементы строки или столбца"""
+    return 'row-major (C)' if array.strides[1] <= array.strides[0] else 'column-major (F)'
+
+
+def debug_transposition_issue(mat_file_path, variable_names=None):
+    """Анализирует и демонстрирует проблему транспонирования
+
+    Из наборов h5py читается только угол 3x3, нужный для примеров значений.
+    variable_names ограничивает разбор через scipy указанными переменными
+    """
+    # Отчет копим в буфере и выводим одной записью в конце
+    buf = io.StringIO()
+
+    def out(*args, **kwargs):
+        print(*args, **kwargs, file=buf)
+
+    try:
+        _debug_transposition_issue(mat_file_path, variable_names, out)
+    finally:
+        sys.stdout.write(buf.getvalue())
+
+
+def _debug_transposition_issue(mat_file_path, variable_names, out):
+    # Работу делает только один из проходов: h5py читает v7.3 (HDF5), scipy - остальные
+    _h5py_probe(mat_file_path, out)
+    _scipy_probe(mat_file_path, variable_names, out)
+
+    # 3. Создаем тестовые данные для проверки
+    out("\n3. Тест на понимание порядка хранения:")
+
+    # Создаем тестовый массив как бы из MATLAB
+    test_matlab_like = np.array([[1, 2, 3],
+                                 [4, 5, 6]], order='F')  # Column-major как в MATLAB
+
+    test_numpy_like = np.array([[1, 2, 3],
+                                [4, 5, 6]], order='C')  # Row-major как в NumPy
+
+    out(f"   MATLAB-style (F): {test_matlab_like.flags['F_CONTIGUOUS']}")
+    out(f"   NumPy-style (C): {test_numpy_like.flags['C_CONTIGUOUS']}")
+
+    # Показываем как они хранятся в памяти
+    out(f"\n   Плоское представление MATLAB-style: {test_matlab_like.flatten()}")
+    out(f"   Плоское представление NumPy-style: {test_numpy_like.flatten()}")
+
+
+def _h5py_probe(mat_file_path, out):
     # 1. Открываем через h5py напрямую
-    print("1. Анализ через h5py:")
+    out("1. Анализ через h5py:")
+    if not _is_hdf5(mat_file_path):
+        out("   Пропущено: файл не в формате v7.3 (HDF5), h5py его не читает")
+        return
+
     with h5py.File(mat_file_path, 'r') as f:
         for key in f.keys():
             if isinstance(f[key], h5py.Dataset):
                 dataset = f[key]
-                data_raw = dataset[()]
-                print(f"   {key}: raw shape = {data_raw.shape}, dtype = {data_raw.dtype}")
+                out(f"   {key}: raw shape = {dataset.shape}, dtype = {dataset.dtype}")
 
-                # Показываем порядок хранения
-                print(f"      C-contiguous: {data_raw.flags['C_CONTIGUOUS']}")
-                print(f"      F-contiguous: {data_raw.flags['F_CONTIGUOUS']}")
+                # Показываем порядок хранения (метаданные набора, без чтения данных)
+                layout = H5_LAYOUTS.get(dataset.id.get_create_plist().get_layout(), 'unknown')
+                out(f"      Storage layout: {layout}, chunks = {dataset.chunks}")
+                out(f"      Compression: {dataset.compression}")
 
                 # Показываем первые значения
-                if data_raw.ndim == 2:
-                    print(f"      Первые значения (raw):")
-                    print(f"      {data_raw[0, 0]:.6f}, {data_raw[0, 1]:.6f}, {data_raw[0, 2]:.6f}")
-                    print(f"      {data_raw[1, 0]:.6f}, {data_raw[1, 1]:.6f}, {data_raw[1, 2]:.6f}")
+                if dataset.ndim == 2:
+                    # h5py читает только чанки, покрывающие угол
+                    data_raw = dataset[0:3, 0:3]
+                    out(f"      Первые значения (raw):")
+                    out(f"      {data_raw[0, 0]:.6f}, {data_raw[0, 1]:.6f}, {data_raw[0, 2]:.6f}")
+                    out(f"      {data_raw[1, 0]:.6f}, {data_raw[1, 1]:.6f}, {data_raw[1, 2]:.6f}")
 
                     # Транспонируем
                     data_transposed = data_raw.T
-                    print(f"\n      Первые значения (транспонированный):")
-                    print(
+                    out(f"\n      Первые значения (транспонированный):")
+                    out(
                         f"      {data_transposed[0, 0]:.6f}, {data_transposed[0, 1]:.6f}, {data_transposed[0, 2]:.6f}")
-                    print(
+                    out(
                         f"      {data_transposed[1, 0]:.6f}, {data_transposed[1, 1]:.6f}, {data_transposed[1, 2]:.6f}")
 
-    # 2. Открываем через scipy (если возможно)
-    print("\n2. Анализ через scipy.io:")
-    try:
-        mat_data = scipy.io.loadmat(mat_file_path)
-        for key in mat_data.keys():
-            if not key.startswith('__'):
-                data = mat_data[key]
-                if isinstance(data, np.ndarray):
-                    print(f"   {key}: shape = {data.shape}, dtype = {data.dtype}")
-                    print(f"      C-contiguous: {data.flags['C_CONTIGUOUS']}")
-                    print(f"      F-contiguous: {data.flags['F_CONTIGUOUS']}")
-
-                    if data.ndim == 2:
-                        print(f"      Первые значения (scipy):")
-                        print(f"      {data[0, 0]:.6f}, {data[0, 1]:.6f}, {data[0, 2]:.6f}")
-                        print(f"      {data[1, 0]:.6f}, {data[1, 1]:.6f}, {data[1, 2]:.6f}")
-    except:
-        print("   Не удалось загрузить через scipy (вероятно v7.3)")
-
-    # 3. Создаем тестовые данные для проверки
-    print("\n3. Тест на понимание порядка хранения:")
+                    # Порядок в памяти виден по шагам (strides), без обращения к данным
+                    out(f"\n      Strides (raw): {data_raw.strides} -> {_memory_order(data_raw)}")
+                    out(f"      Strides (транспонированный): {data_transposed.strides} -> "
+                        f"{_memory_order(data_transposed)}")
 
-    # Создаем тестовый массив как бы из MATLAB
-    test_matlab_like = np.array([[1, 2, 3],
-                                 [4, 5, 6]], order='F')  # Column-major как в MATLAB
 
-    test_numpy_like = np.array([[1, 2, 3],
-                                [4, 5, 6]], order='C')  # Row-major как в NumPy
+def _scipy_probe(mat_file_path, variable_names, out):
+    # 2. Открываем через scipy (если возможно)
+    out("\n2. Анализ через scipy.io:")
+    if _is_hdf5(mat_file_path):
+        out("   Пропущено: файл в формате v7.3 (HDF5), scipy его не читает")
+    else:
+        try:
+            mat_data = scipy.io.loadmat(mat_file_path, variable_names=variable_names)
+            for key in mat_data.keys():
+                if not key.startswith('__'):
+                    data = mat_data[key]
+                    if isinstance(data, np.ndarray):
+                        out(f"   {key}: shape = {data.shape}, dtype = {data.dtype}")
+                        out(f"      C-contiguous: {data.flags['C_CONTIGUOUS']}")
+                        out(f"      F-contiguous: {data.flags['F_CONTIGUOUS']}")
 
-    print(f"   MATLAB-style (F): {test_matlab_like.flags['F_CONTIGUOUS']}")
-    print(f"   NumPy-style (C): {test_numpy_like.flags['C_CONTIGUOUS']}")
+                        if data.ndim == 2:
+                            out(f"      Первые значения (scipy):")
+                            out(f"      {data[0, 0]:.6f}, {data[0, 1]:.6f}, {data[0, 2]:.6f}")
+                            out(f"      {data[1, 0]:.6f}, {data[1, 1]:.6f}, {data[1, 2]:.6f}")
+        except (NotImplementedError, ValueError) as e:
+            out(f"   Не удалось загрузить через scipy: {e}")
 
-    # Показываем как они хранятся в памяти
-    print(f"\n   Плоское представление MATLAB-style: {test_matlab_like.flatten()}")
-    print(f"   Плоское представление NumPy-style: {test_numpy_like.flatten()}")
 
 # Использование:
 debug_transposition_issue('/home/linkoln-xd/python_projects/fordew/bm/1/1_1_1-pr_Page_141-PZU0001.mat')
\ No newline at end of file